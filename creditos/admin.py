@@ -1,4 +1,6 @@
+from datetime import date, timedelta
 from django.contrib import admin
+from django.db.models import Case, DurationField, ExpressionWrapper, F, Value, When
 from .models import Prestamo, Amortizacion
 
 class AmortizacionInline(admin.TabularInline):
@@ -6,16 +8,28 @@ class AmortizacionInline(admin.TabularInline):
     extra = 0
     readonly_fields = ['numero_cuota', 'fecha_pago', 'cuota', 'capital', 'interes', 'saldo', 'dias_mora', 'estado']
     can_delete = False
+    show_change_link = False
+    ordering = ('numero_cuota',)
     
     def has_add_permission(self, request, obj=None):
         return False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('prestamo').only(
+            'id', 'prestamo', 'numero_cuota', 'fecha_pago', 'cuota',
+            'capital', 'interes', 'saldo', 'pagado', 'fecha_pago_real',
+            'prestamo__nombre'
+        )
 
 @admin.register(Prestamo)
 class PrestamoAdmin(admin.ModelAdmin):
     list_display = ['nombre', 'ci', 'monto', 'tasa_interes_anual', 'plazo', 'fecha_inicio', 'cuota_mensual_display']
     list_filter = ['fecha_inicio', 'fecha_creacion']
     search_fields = ['nombre', 'ci']
-    readonly_fields = ['tasa_mensual_display', 'cuota_mensual_display', 'fecha_creacion', 'fecha_actualizacion']
+    readonly_fields = [
+        'tasa_mensual_display', 'cuota_mensual_display', 'total_cuotas', 'total_capital',
+        'total_interes', 'cuotas_pagadas', 'fecha_creacion', 'fecha_actualizacion'
+    ]
     
     fieldsets = (
         ('Información del Cliente', {
@@ -25,7 +39,7 @@ class PrestamoAdmin(admin.ModelAdmin):
             'fields': ('monto', 'tasa_interes_anual', 'tasa_mensual_display', 'fecha_inicio', 'plazo')
         }),
         ('Cálculos', {
-            'fields': ('cuota_mensual_display',),
+            'fields': ('cuota_mensual_display', 'total_cuotas', 'total_capital', 'total_interes', 'cuotas_pagadas'),
             'classes': ('collapse',)
         }),
         ('Metadatos', {
@@ -36,6 +50,17 @@ class PrestamoAdmin(admin.ModelAdmin):
     
     inlines = [AmortizacionInline]
     
+    def save_related(self, request, form, formsets, change):
+        if set(form.changed_data) & set(Prestamo.CAMPOS_AMORTIZACION):
+            # save_model ya regeneró la tabla: las filas del inline fueron reemplazadas
+            for formset in formsets:
+                if formset.model is Amortizacion:
+                    formset.new_objects = []
+                    formset.changed_objects = []
+                    formset.deleted_objects = []
+            formsets = [formset for formset in formsets if formset.model is not Amortizacion]
+        super().save_related(request, form, formsets, change)
+    
     def tasa_mensual_display(self, obj):
         if obj.tasa_mensual is None:
             return "-"
@@ -48,10 +73,20 @@ class PrestamoAdmin(admin.ModelAdmin):
         return f"Bs. {obj.cuota_mensual:,.2f}"
     cuota_mensual_display.short_description = 'Cuota Mensual'
 
+class PrestamoListFilter(admin.RelatedFieldListFilter):
+    """Filtro por préstamo que solo lee las columnas de Prestamo.__str__"""
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        prestamos = Prestamo.objects.only('id', 'nombre', 'ci', 'monto')
+        if ordering:
+            prestamos = prestamos.order_by(*ordering)
+        return [(prestamo.pk, str(prestamo)) for prestamo in prestamos]
+
 @admin.register(Amortizacion)
 class AmortizacionAdmin(admin.ModelAdmin):
-    list_display = ['prestamo', 'numero_cuota', 'fecha_pago', 'cuota', 'capital', 'interes', 'saldo', 'estado', 'pagado']
-    list_filter = ['pagado', 'fecha_pago', 'prestamo']
+    list_display = ['prestamo', 'numero_cuota', 'fecha_pago', 'cuota', 'capital', 'interes', 'saldo', 'estado_display', 'pagado']
+    list_filter = ['pagado', 'fecha_pago', ('prestamo', PrestamoListFilter)]
+    list_select_related = ('prestamo',)
     search_fields = ['prestamo__nombre', 'prestamo__ci']
     readonly_fields = ['dias_mora', 'estado']
     
@@ -65,4 +100,39 @@ class AmortizacionAdmin(admin.ModelAdmin):
         ('Estado de Pago', {
             'fields': ('pagado', 'fecha_pago_real', 'dias_mora', 'estado')
         }),
-    )
\ No newline at end of file
+    )
+    
+    def get_queryset(self, request):
+        # Calcular los días de mora en la base de datos en lugar de por fila en Python
+        hoy = date.today()
+        return super().get_queryset(request).select_related('prestamo').annotate(
+            _dias_mora=Case(
+                When(pagado=False, fecha_pago__lt=hoy, then=ExpressionWrapper(
+                    Value(hoy) - F('fecha_pago'), output_field=DurationField()
+                )),
+                default=Value(timedelta(0)),
+                output_field=DurationField(),
+            )
+        )
+    
+    def delete_queryset(self, request, queryset):
+        # El borrado masivo no pasa por Amortizacion.delete(): recalcular los totales aquí
+        prestamo_ids = set(queryset.values_list('prestamo_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for prestamo in Prestamo.objects.filter(pk__in=prestamo_ids).only('pk'):
+            prestamo.actualizar_totales()
+    
+    def estado_display(self, obj):
+        if obj.pagado:
+            return "PAGADA"
+        dias_mora = obj._dias_mora.days
+        if dias_mora > 0:
+            return f"MORA ({dias_mora} días)"
+        return "PENDIENTE"
+    estado_display.short_description = 'Estado'
+    
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Solo las columnas que usa Prestamo.__str__ para las opciones del select
+        if db_field.name == 'prestamo':
+            kwargs['queryset'] = Prestamo.objects.only('id', 'nombre', 'ci', 'monto')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
\ No newline at end of file
@@ -4,6 +4,11 @@ from decimal import Decimal
 import re
 from datetime import date
 
+__all__ = ['PrestamoForm', 'AmortizacionForm']
+
+_NOMBRE_RE = re.compile(r'^[a-zA-ZáéíóúÁÉÍÓÚñÑ\s]+$')
+_CI_RE = re.compile(r'^\d{5,10}(\s?[A-Z]{2})?$')
+
 class PrestamoForm(forms.ModelForm):
     class Meta:
         model = Prestamo
@@ -36,6 +41,11 @@ class PrestamoForm(forms.ModelForm):
                 'placeholder': 'Número de meses'
             }),
         }
+        error_messages = {
+            'ci': {
+                'unique': "Ya existe un préstamo registrado con esta cédula de identidad.",
+            },
+        }
     
     def clean_nombre(self):
         """Validar que el nombre solo contenga letras y espacios"""
@@ -48,7 +58,7 @@ class PrestamoForm(forms.ModelForm):
         nombre = ' '.join(nombre.split())
         
         # Validar que solo contenga letras y espacios
-        if not re.match(r'^[a-zA-ZáéíóúÁÉÍÓÚñÑ\s]+$', nombre):
+        if not _NOMBRE_RE.match(nombre):
             raise forms.ValidationError("El nombre solo debe contener letras y espacios.")
         
         # Validar longitud mínima
@@ -68,24 +78,12 @@ class PrestamoForm(forms.ModelForm):
         ci = ci.strip().upper()
         
         # Validar formato (números y opcionalmente extensión: LP, SC, CB, etc.)
-        if not re.match(r'^\d{5,10}(\s?[A-Z]{2})?$', ci):
+        if not _CI_RE.match(ci):
             raise forms.ValidationError(
                 "Formato de CI inválido. Use formato: 12345678 o 12345678 LP"
             )
         
-        # Verificar que no exista otro préstamo con el mismo CI
-        if self.instance.pk:
-            # Estamos editando, excluir el registro actual
-            existe = Prestamo.objects.filter(ci=ci).exclude(pk=self.instance.pk).exists()
-        else:
-            # Es nuevo registro
-            existe = Prestamo.objects.filter(ci=ci).exists()
-        
-        if existe:
-            raise forms.ValidationError(
-                "Ya existe un préstamo registrado con esta cédula de identidad."
-            )
-        
+        # La unicidad del CI la verifica validate_unique (ver Meta.error_messages)
         return ci
     
     def clean_monto(self):
@@ -173,7 +171,8 @@ class PrestamoForm(forms.ModelForm):
             
             # Calcular cuota mensual
             if tasa_mensual > 0:
-                cuota = monto * (tasa_mensual * (1 + tasa_mensual)**plazo) / ((1 + tasa_mensual)**plazo - 1)
+                factor = (1 + tasa_mensual)**plazo
+                cuota = monto * (tasa_mensual * factor) / (factor - 1)
             else:
                 cuota = monto / plazo
             
@@ -201,6 +200,29 @@ class AmortizacionForm(forms.ModelForm):
             }),
         }
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Estado original de la cuota antes de la edición
+        self._was_pagado = self.instance.pagado if self.instance.pk else False
+    
+    def save(self, commit=True):
+        """Guarda solo las columnas editables de la cuota"""
+        instance = super().save(commit=False)
+        if commit:
+            update_fields = None if instance._state.adding else self._meta.fields
+            instance.save(update_fields=update_fields)
+            self._save_m2m()
+        return instance
+    
+    def _cuota_anterior(self):
+        """Obtiene (una sola vez) número, estado y fecha de pago real de la cuota anterior"""
+        if not hasattr(self, '_cuota_anterior_cache'):
+            self._cuota_anterior_cache = Amortizacion.objects.filter(
+                prestamo_id=self.instance.prestamo_id,
+                numero_cuota=self.instance.numero_cuota - 1
+            ).values_list('numero_cuota', 'pagado', 'fecha_pago_real', named=True).first()
+        return self._cuota_anterior_cache
+    
     def clean(self):
         """Validar que si está marcado como pagado, tenga fecha de pago real"""
         cleaned_data = super().clean()
@@ -218,10 +240,7 @@ class AmortizacionForm(forms.ModelForm):
         # NUEVA VALIDACIÓN: Verificar que las cuotas anteriores estén pagadas
         if pagado and self.instance.numero_cuota > 1:
             # Buscar la cuota anterior
-            cuota_anterior = Amortizacion.objects.filter(
-                prestamo=self.instance.prestamo,
-                numero_cuota=self.instance.numero_cuota - 1
-            ).first()
+            cuota_anterior = self._cuota_anterior()
             
             if cuota_anterior and not cuota_anterior.pagado:
                 raise forms.ValidationError(
@@ -232,11 +251,10 @@ class AmortizacionForm(forms.ModelForm):
         # NUEVA VALIDACIÓN: No permitir despagar si hay cuotas posteriores pagadas
         if not pagado and self.instance.pk:
             # Verificar si ya estaba pagada anteriormente
-            cuota_actual = Amortizacion.objects.get(pk=self.instance.pk)
-            if cuota_actual.pagado:
+            if self._was_pagado:
                 # Buscar si hay cuotas posteriores pagadas
                 cuotas_posteriores_pagadas = Amortizacion.objects.filter(
-                    prestamo=self.instance.prestamo,
+                    prestamo_id=self.instance.prestamo_id,
                     numero_cuota__gt=self.instance.numero_cuota,
                     pagado=True
                 ).exists()
@@ -270,13 +288,9 @@ class AmortizacionForm(forms.ModelForm):
                 
                 # NUEVA VALIDACIÓN: Verificar que no sea anterior a la fecha de pago de la cuota anterior
                 if self.instance.numero_cuota > 1:
-                    cuota_anterior = Amortizacion.objects.filter(
-                        prestamo=self.instance.prestamo,
-                        numero_cuota=self.instance.numero_cuota - 1,
-                        pagado=True
-                    ).first()
+                    cuota_anterior = self._cuota_anterior()
                     
-                    if cuota_anterior and cuota_anterior.fecha_pago_real:
+                    if cuota_anterior and cuota_anterior.pagado and cuota_anterior.fecha_pago_real:
                         if fecha < cuota_anterior.fecha_pago_real:
                             raise forms.ValidationError(
                                 f"La fecha de pago no puede ser anterior a la fecha de pago "
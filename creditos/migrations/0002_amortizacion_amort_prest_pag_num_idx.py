@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('creditos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='amortizacion',
+            index=models.Index(fields=['prestamo', 'pagado', 'numero_cuota'], name='amort_prest_pag_num_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-15 11:40
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def calcular_totales(apps, schema_editor):
+    Prestamo = apps.get_model('creditos', 'Prestamo')
+    for prestamo in Prestamo.objects.only('pk').iterator():
+        totales = prestamo.amortizaciones.aggregate(
+            total_cuotas=Sum('cuota', default=Decimal('0.00')),
+            total_capital=Sum('capital', default=Decimal('0.00')),
+            total_interes=Sum('interes', default=Decimal('0.00')),
+            cuotas_pagadas=Count('pk', filter=Q(pagado=True)),
+        )
+        Prestamo.objects.filter(pk=prestamo.pk).update(**totales)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('creditos', '0002_amortizacion_amort_prest_pag_num_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prestamo',
+            name='cuotas_pagadas',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Cuotas Pagadas'),
+        ),
+        migrations.AddField(
+            model_name='prestamo',
+            name='total_capital',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='Total Capital'),
+        ),
+        migrations.AddField(
+            model_name='prestamo',
+            name='total_cuotas',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='Total a Pagar'),
+        ),
+        migrations.AddField(
+            model_name='prestamo',
+            name='total_interes',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='Total Interés'),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
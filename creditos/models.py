@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Q, Sum
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
+from functools import cached_property
 from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 
@@ -30,6 +32,40 @@ class Prestamo(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     
+    # Totales de la tabla de amortización, mantenidos al escribir las cuotas
+    total_cuotas = models.DecimalField(
+        max_digits=14, 
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Total a Pagar"
+    )
+    total_capital = models.DecimalField(
+        max_digits=14, 
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Total Capital"
+    )
+    total_interes = models.DecimalField(
+        max_digits=14, 
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Total Interés"
+    )
+    cuotas_pagadas = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Cuotas Pagadas"
+    )
+    
+    # Campos de los que depende la tabla de amortización
+    CAMPOS_AMORTIZACION = ('monto', 'tasa_interes_anual', 'fecha_inicio', 'plazo')
+    
+    # Campos desnormalizados que solo se escriben con actualizar_totales() o update()
+    CAMPOS_TOTALES = ('total_cuotas', 'total_capital', 'total_interes', 'cuotas_pagadas')
+    
     class Meta:
         verbose_name = "Préstamo"
         verbose_name_plural = "Préstamos"
@@ -38,14 +74,20 @@ class Prestamo(models.Model):
     def __str__(self):
         return f"{self.nombre} - CI: {self.ci} - Bs. {self.monto}"
     
-    @property
+    def clean(self):
+        """Normaliza el CI antes de validate_unique para que la restricción única coincida"""
+        super().clean()
+        if self.ci:
+            self.ci = self.ci.strip().upper()
+    
+    @cached_property
     def tasa_mensual(self):
         """Calcula la tasa de interés mensual"""
         if self.tasa_interes_anual is None:
             return None
         return self.tasa_interes_anual / Decimal('12') / Decimal('100')
     
-    @property
+    @cached_property
     def cuota_mensual(self):
         """Calcula la cuota mensual usando el método francés"""
         if not all([self.monto, self.tasa_interes_anual, self.plazo]):
@@ -57,24 +99,30 @@ class Prestamo(models.Model):
         if i == 0:
             return self.monto / n
         
-        cuota = self.monto * (i * (1 + i)**n) / ((1 + i)**n - 1)
+        factor = (1 + i)**n
+        cuota = self.monto * (i * factor) / (factor - 1)
         return cuota.quantize(Decimal('0.01'))
     
+    def limpiar_calculos(self):
+        """Descarta la tasa y cuota mensual memorizadas para recalcularlas"""
+        self.__dict__.pop('tasa_mensual', None)
+        self.__dict__.pop('cuota_mensual', None)
+    
     def generar_amortizacion(self):
         """Genera la tabla de amortización completa"""
-        # Eliminar amortizaciones anteriores si existen
-        self.amortizaciones.all().delete()
-        
+        self.limpiar_calculos()
         saldo = self.monto
         cuota = self.cuota_mensual
+        tasa_mensual = self.tasa_mensual
         fecha_pago = self.fecha_inicio
+        filas = []
         
         for numero_cuota in range(1, self.plazo + 1):
             # Calcular fecha de pago (agregar un mes)
             fecha_pago = fecha_pago + relativedelta(months=1)
             
             # Calcular interés del período
-            interes = (saldo * self.tasa_mensual).quantize(Decimal('0.01'))
+            interes = (saldo * tasa_mensual).quantize(Decimal('0.01'))
             
             # Calcular capital (amortización)
             if numero_cuota == self.plazo:
@@ -90,8 +138,8 @@ class Prestamo(models.Model):
             if nuevo_saldo < 0:
                 nuevo_saldo = Decimal('0.00')
             
-            # Crear registro de amortización
-            Amortizacion.objects.create(
+            # Acumular registro de amortización
+            filas.append(Amortizacion(
                 prestamo=self,
                 numero_cuota=numero_cuota,
                 fecha_pago=fecha_pago,
@@ -99,19 +147,85 @@ class Prestamo(models.Model):
                 capital=capital,
                 interes=interes,
                 saldo=nuevo_saldo
-            )
+            ))
             
             # Actualizar saldo para la siguiente iteración
             saldo = nuevo_saldo
+        
+        # Totales de la nueva tabla (todas las cuotas quedan pendientes)
+        totales = {
+            'total_cuotas': sum(fila.cuota for fila in filas),
+            'total_capital': sum(fila.capital for fila in filas),
+            'total_interes': sum(fila.interes for fila in filas),
+            'cuotas_pagadas': 0,
+        }
+        
+        # Reemplazar amortizaciones anteriores en una sola transacción
+        with transaction.atomic():
+            self.amortizaciones.all().delete()
+            Amortizacion.objects.bulk_create(filas, batch_size=500)
+            Prestamo.objects.filter(pk=self.pk).update(**totales)
+        
+        for campo, valor in totales.items():
+            setattr(self, campo, valor)
+    
+    def actualizar_totales(self):
+        """Recalcula los totales desnormalizados a partir de las cuotas guardadas"""
+        totales = self.amortizaciones.aggregate(
+            total_cuotas=Sum('cuota', default=Decimal('0.00')),
+            total_capital=Sum('capital', default=Decimal('0.00')),
+            total_interes=Sum('interes', default=Decimal('0.00')),
+            cuotas_pagadas=Count('pk', filter=Q(pagado=True)),
+        )
+        Prestamo.objects.filter(pk=self.pk).update(**totales)
+        
+        for campo, valor in totales.items():
+            setattr(self, campo, valor)
+    
+    def requiere_regenerar(self, update_fields=None):
+        """Verifica si cambió algún campo del que depende la amortización"""
+        campos = self.CAMPOS_AMORTIZACION
+        if update_fields is not None:
+            campos = [campo for campo in campos if campo in update_fields]
+            if not campos:
+                return False
+        
+        anterior = Prestamo.objects.filter(pk=self.pk).values_list(*campos).first()
+        if anterior is None:
+            return True
+        return anterior != tuple(getattr(self, campo) for campo in campos)
     
     def save(self, *args, **kwargs):
-        """Override del método save para generar amortización automáticamente"""
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
+        """
+        Override del método save para generar amortización automáticamente.
         
-        # Solo generar amortización si es un nuevo préstamo
-        if is_new:
-            self.generar_amortizacion()
+        La tabla se regenera solo si el préstamo es nuevo o si cambió monto,
+        tasa, fecha de inicio o plazo. Para actualizaciones parciales pase
+        update_fields explícitamente y así evitar la consulta de comparación.
+        """
+        is_new = self.pk is None
+        self.limpiar_calculos()
+        with transaction.atomic():
+            regenerar = is_new or self.requiere_regenerar(kwargs.get('update_fields'))
+            actualizacion = (
+                not is_new
+                and not self._state.adding
+                and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None
+            )
+            if actualizacion:
+                # No sobrescribir los totales con valores posiblemente desactualizados
+                deferidos = self.get_deferred_fields()
+                kwargs['update_fields'] = [
+                    campo.name for campo in self._meta.concrete_fields
+                    if not campo.primary_key
+                    and campo.name not in self.CAMPOS_TOTALES
+                    and campo.attname not in deferidos
+                ]
+            super().save(*args, **kwargs)
+            
+            if regenerar:
+                self.generar_amortizacion()
 
 
 class Amortizacion(models.Model):
@@ -155,10 +269,70 @@ class Amortizacion(models.Model):
         verbose_name_plural = "Cuotas de Amortización"
         ordering = ['prestamo', 'numero_cuota']
         unique_together = ['prestamo', 'numero_cuota']
+        indexes = [
+            models.Index(fields=['prestamo', 'pagado', 'numero_cuota'], name='amort_prest_pag_num_idx'),
+        ]
+    
+    # Campos de la cuota que afectan los totales del préstamo
+    CAMPOS_TOTALES = ('cuota', 'capital', 'interes', 'pagado')
     
     def __str__(self):
         return f"Cuota {self.numero_cuota} - {self.prestamo.nombre}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Recordar los valores cargados para detectar cambios al guardar
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+    
+    def _prestamo_para_totales(self):
+        if Amortizacion.prestamo.is_cached(self):
+            return self.prestamo
+        return Prestamo(pk=self.prestamo_id)
+    
+    def save(self, *args, **kwargs):
+        """Override del método save para mantener los totales del préstamo"""
+        es_nueva = self._state.adding
+        originales = getattr(self, '_valores_originales', {})
+        update_fields = kwargs.get('update_fields')
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            campos = [
+                campo for campo in self.CAMPOS_TOTALES
+                if update_fields is None or campo in update_fields
+            ]
+            cambiados = [
+                campo for campo in campos
+                if campo not in originales or originales[campo] != getattr(self, campo)
+            ]
+            
+            prestamo_anterior = originales.get('prestamo_id', self.prestamo_id)
+            movida = prestamo_anterior != self.prestamo_id and (
+                update_fields is None or {'prestamo', 'prestamo_id'} & set(update_fields)
+            )
+            
+            if movida:
+                # La cuota pasó a otro préstamo: recalcular ambos
+                Prestamo(pk=prestamo_anterior).actualizar_totales()
+                self._prestamo_para_totales().actualizar_totales()
+            elif es_nueva or cambiados:
+                # Recalcular desde las cuotas guardadas (idempotente ante guardados repetidos)
+                self._prestamo_para_totales().actualizar_totales()
+        
+        self._valores_originales = {
+            campo: self.__dict__[campo]
+            for campo in (*self.CAMPOS_TOTALES, 'prestamo_id') if campo in self.__dict__
+        }
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            self._prestamo_para_totales().actualizar_totales()
+        return resultado
+    
     @property
     def dias_mora(self):
         """Calcula los días de mora si la cuota no está pagada"""
@@ -187,7 +361,7 @@ class Amortizacion(models.Model):
         
         # Verificar si hay cuotas anteriores sin pagar
         cuotas_anteriores_pendientes = Amortizacion.objects.filter(
-            prestamo=self.prestamo,
+            prestamo_id=self.prestamo_id,
             numero_cuota__lt=self.numero_cuota,
             pagado=False
         ).exists()
@@ -197,7 +371,7 @@ class Amortizacion(models.Model):
     def tiene_cuotas_posteriores_pagadas(self):
         """Verifica si hay cuotas posteriores pagadas"""
         return Amortizacion.objects.filter(
-            prestamo=self.prestamo,
+            prestamo_id=self.prestamo_id,
             numero_cuota__gt=self.numero_cuota,
             pagado=True
         ).exists()
\ No newline at end of file
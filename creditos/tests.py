@@ -1,3 +1,251 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Q, Sum
 from django.test import TestCase
+from django.urls import reverse
+
+from .models import Prestamo, Amortizacion
+from .views import _detalle_url
+
+
+def crear_prestamo(**kwargs):
+    datos = {
+        'nombre': 'JUAN PEREZ',
+        'ci': '1234567 LP',
+        'monto': Decimal('1000.00'),
+        'tasa_interes_anual': Decimal('12.00'),
+        'fecha_inicio': date.today(),
+        'plazo': 6,
+    }
+    datos.update(kwargs)
+    return Prestamo.objects.create(**datos)
+
+
+class PrestamoAdminTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        self.client.force_login(self.usuario)
+        self.prestamo = crear_prestamo()
+
+    def datos_cambio(self, pagar_primera=True, **kwargs):
+        """Datos POST del formulario de cambio del préstamo con su inline de cuotas"""
+        cuotas = list(self.prestamo.amortizaciones.order_by('numero_cuota'))
+        datos = {
+            'nombre': self.prestamo.nombre,
+            'ci': self.prestamo.ci,
+            'monto': str(self.prestamo.monto),
+            'tasa_interes_anual': str(self.prestamo.tasa_interes_anual),
+            'fecha_inicio': self.prestamo.fecha_inicio.isoformat(),
+            'plazo': str(self.prestamo.plazo),
+            'amortizaciones-TOTAL_FORMS': str(len(cuotas)),
+            'amortizaciones-INITIAL_FORMS': str(len(cuotas)),
+            'amortizaciones-MIN_NUM_FORMS': '0',
+            'amortizaciones-MAX_NUM_FORMS': '0',
+            '_save': 'Guardar',
+        }
+        for indice, cuota in enumerate(cuotas):
+            datos[f'amortizaciones-{indice}-id'] = str(cuota.pk)
+            datos[f'amortizaciones-{indice}-prestamo'] = str(self.prestamo.pk)
+            datos[f'amortizaciones-{indice}-fecha_pago_real'] = ''
+            if pagar_primera and indice == 0:
+                datos[f'amortizaciones-{indice}-pagado'] = 'on'
+        datos.update(kwargs)
+        return datos
+
+    def test_cambio_de_monto_con_cuota_pagada_regenera_la_tabla(self):
+        url = reverse('admin:creditos_prestamo_change', args=[self.prestamo.pk])
+        respuesta = self.client.post(url, self.datos_cambio(monto='2000.00'))
+
+        self.assertEqual(respuesta.status_code, 302)
+        self.prestamo.refresh_from_db()
+        self.assertEqual(self.prestamo.monto, Decimal('2000.00'))
+        self.assertEqual(self.prestamo.amortizaciones.count(), 6)
+        self.assertFalse(self.prestamo.amortizaciones.filter(pagado=True).exists())
+
+    def test_pago_sin_cambio_de_condiciones_se_guarda(self):
+        url = reverse('admin:creditos_prestamo_change', args=[self.prestamo.pk])
+        respuesta = self.client.post(url, self.datos_cambio())
+
+        self.assertEqual(respuesta.status_code, 302)
+        primera = self.prestamo.amortizaciones.get(numero_cuota=1)
+        self.assertTrue(primera.pagado)
+
+    def test_ci_duplicado_en_minusculas_es_error_de_validacion(self):
+        datos = {
+            'nombre': 'MARIA LOPEZ',
+            'ci': ' 1234567 lp ',
+            'monto': '500.00',
+            'tasa_interes_anual': '10.00',
+            'fecha_inicio': date.today().isoformat(),
+            'plazo': '3',
+            'amortizaciones-TOTAL_FORMS': '0',
+            'amortizaciones-INITIAL_FORMS': '0',
+            'amortizaciones-MIN_NUM_FORMS': '0',
+            'amortizaciones-MAX_NUM_FORMS': '0',
+            '_save': 'Guardar',
+        }
+        respuesta = self.client.post(reverse('admin:creditos_prestamo_add'), datos)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('ci', respuesta.context['adminform'].form.errors)
+        self.assertEqual(Prestamo.objects.count(), 1)
+
+    def test_filtro_por_prestamo_en_cuotas(self):
+        url = reverse('admin:creditos_amortizacion_changelist')
+        respuesta = self.client.get(url, {'prestamo__id__exact': self.prestamo.pk})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, str(self.prestamo))
+        self.assertEqual(respuesta.context['cl'].result_count, 6)
+
+
+class TotalesPrestamoTests(TestCase):
+    def setUp(self):
+        self.prestamo = crear_prestamo()
+
+    def assertTotalesCoinciden(self, prestamo):
+        """Los totales guardados deben coincidir con un aggregate() de las cuotas"""
+        prestamo.refresh_from_db()
+        esperado = prestamo.amortizaciones.aggregate(
+            total_cuotas=Sum('cuota', default=Decimal('0.00')),
+            total_capital=Sum('capital', default=Decimal('0.00')),
+            total_interes=Sum('interes', default=Decimal('0.00')),
+            cuotas_pagadas=Count('pk', filter=Q(pagado=True)),
+        )
+        guardado = {campo: getattr(prestamo, campo) for campo in esperado}
+        self.assertEqual(guardado, esperado)
+
+    def test_crear(self):
+        self.assertEqual(self.prestamo.amortizaciones.count(), 6)
+        self.assertTotalesCoinciden(self.prestamo)
+
+    def test_pagar_y_despagar(self):
+        cuota = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=1)
+        cuota.pagado = True
+        cuota.save()
+        self.assertTotalesCoinciden(self.prestamo)
+        self.assertEqual(self.prestamo.cuotas_pagadas, 1)
+
+        cuota = Amortizacion.objects.get(pk=cuota.pk)
+        cuota.pagado = False
+        cuota.save()
+        self.assertTotalesCoinciden(self.prestamo)
+        self.assertEqual(self.prestamo.cuotas_pagadas, 0)
+
+    def test_pagar_la_misma_cuota_desde_dos_copias(self):
+        primera = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=1)
+        segunda = Amortizacion.objects.get(pk=primera.pk)
+        for copia in (primera, segunda):
+            copia.pagado = True
+            copia.save()
+
+        self.assertTotalesCoinciden(self.prestamo)
+        self.assertEqual(self.prestamo.cuotas_pagadas, 1)
+
+    def test_editar_montos_de_cuota(self):
+        cuota = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=2)
+        cuota.cuota += Decimal('10.00')
+        cuota.interes += Decimal('10.00')
+        cuota.save()
+        self.assertTotalesCoinciden(self.prestamo)
+
+    def test_eliminar_cuota(self):
+        Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=6).delete()
+        self.assertTotalesCoinciden(self.prestamo)
+
+    def test_borrado_masivo_en_admin(self):
+        usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        self.client.force_login(usuario)
+        cuotas = list(self.prestamo.amortizaciones.filter(numero_cuota__gte=5).values_list('pk', flat=True))
+
+        respuesta = self.client.post(reverse('admin:creditos_amortizacion_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [str(pk) for pk in cuotas],
+            'post': 'yes',
+        })
+
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(self.prestamo.amortizaciones.count(), 4)
+        self.assertTotalesCoinciden(self.prestamo)
+
+    def test_mover_cuota_a_otro_prestamo(self):
+        otro = crear_prestamo(nombre='ANA ROJAS', ci='7654321 SC', monto=Decimal('3000.00'))
+        cuota = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=3)
+        cuota.prestamo = otro
+        cuota.numero_cuota = 7
+        cuota.save()
+
+        self.assertEqual(self.prestamo.amortizaciones.count(), 5)
+        self.assertEqual(otro.amortizaciones.count(), 7)
+        self.assertTotalesCoinciden(self.prestamo)
+        self.assertTotalesCoinciden(otro)
+
+    def test_clonar_prestamo(self):
+        clon = Prestamo.objects.get(pk=self.prestamo.pk)
+        clon.pk = None
+        clon.ci = '7654321 SC'
+        clon.save()
+
+        self.assertNotEqual(clon.pk, self.prestamo.pk)
+        self.assertEqual(clon.amortizaciones.count(), 6)
+        self.assertTotalesCoinciden(clon)
+        self.assertTotalesCoinciden(self.prestamo)
+
+    def test_crear_con_pk_explicito(self):
+        creado = crear_prestamo(pk=99, ci='1111111 CB')
+        self.assertEqual(creado.pk, 99)
+        self.assertEqual(creado.amortizaciones.count(), 6)
+        self.assertTotalesCoinciden(creado)
+
+        nuevo = Prestamo(
+            pk=77, nombre='LUIS MAMANI', ci='2222222 OR', monto=Decimal('800.00'),
+            tasa_interes_anual=Decimal('10.00'), fecha_inicio=date.today(), plazo=4
+        )
+        nuevo.save()
+        self.assertTrue(Prestamo.objects.filter(pk=77).exists())
+        self.assertEqual(nuevo.amortizaciones.count(), 4)
+        self.assertTotalesCoinciden(nuevo)
+
+
+class VistasPrestamoTests(TestCase):
+    def setUp(self):
+        self.prestamo = crear_prestamo()
+
+    def test_detalle_url_coincide_con_reverse(self):
+        self.assertEqual(_detalle_url(self.prestamo.pk), reverse('prestamo_detalle', args=[self.prestamo.pk]))
+
+    def test_detalle_cuenta_pendientes_de_las_cuotas_guardadas(self):
+        Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=6).delete()
+        cuota = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=1)
+        cuota.pagado = True
+        cuota.save()
+
+        respuesta = self.client.get(reverse('prestamo_detalle', args=[self.prestamo.pk]))
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['cuotas_pagadas'], 1)
+        self.assertEqual(respuesta.context['cuotas_pendientes'], 4)
+        self.assertEqual(respuesta.context['primera_cuota_pendiente'], 2)
+
+    def test_detalle_json(self):
+        Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=6).delete()
+        cuota = Amortizacion.objects.get(prestamo=self.prestamo, numero_cuota=1)
+        cuota.pagado = True
+        cuota.save()
+
+        respuesta = self.client.get(reverse('prestamo_detalle_json', args=[self.prestamo.pk]))
 
-# Create your tests here.
+        self.assertEqual(respuesta.status_code, 200)
+        data = respuesta.json()
+        self.assertEqual(len(data['amortizaciones']), 5)
+        esperado = self.prestamo.amortizaciones.aggregate(
+            total_cuotas=Sum('cuota'),
+            total_capital=Sum('capital'),
+            total_interes=Sum('interes'),
+        )
+        for campo, valor in esperado.items():
+            self.assertEqual(Decimal(data[campo]), valor)
+        self.assertEqual(data['cuotas_pagadas'], 1)
+        self.assertEqual(data['cuotas_pendientes'], 4)
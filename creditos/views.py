@@ -1,9 +1,47 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db.models import Q
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, Min, Q, Sum
+from django.http import HttpResponseRedirect, JsonResponse
+from django.urls import reverse
+from django.utils.text import format_lazy
+from django.utils.translation import gettext_lazy as _
 from .models import Prestamo, Amortizacion
 from .forms import PrestamoForm, AmortizacionForm
 
+PRESTAMOS_POR_PAGINA = 25
+
+# Columnas que muestra la lista de préstamos (incluye las de cuota_mensual)
+PRESTAMO_LISTA_CAMPOS = (
+    'pk', 'nombre', 'ci', 'monto', 'tasa_interes_anual', 'plazo', 'fecha_inicio', 'fecha_creacion',
+    'cuotas_pagadas'
+)
+
+# Columnas del detalle: datos del préstamo, cálculos y totales desnormalizados
+PRESTAMO_DETALLE_CAMPOS = (
+    'pk', 'nombre', 'ci', 'monto', 'tasa_interes_anual', 'plazo', 'fecha_inicio',
+    'total_cuotas', 'total_capital', 'total_interes', 'cuotas_pagadas'
+)
+
+# Columnas del formulario de edición (fecha_actualizacion invalida su caché)
+PRESTAMO_EDITAR_CAMPOS = (
+    'pk', 'nombre', 'ci', 'monto', 'tasa_interes_anual', 'fecha_inicio', 'plazo',
+    'fecha_actualizacion'
+)
+
+# Columnas que muestra la confirmación de eliminación
+PRESTAMO_ELIMINAR_CAMPOS = ('pk', 'nombre', 'ci', 'monto', 'plazo', 'fecha_inicio')
+
+def _detalle_url(pk):
+    """URL del detalle de un préstamo para los redirects tras guardar.
+
+    Se arma sobre el prefijo de la lista (sin memorizar, para respetar el script
+    prefix y el urlconf de cada petición); asume que 'prestamo_detalle' es
+    '<pk>/' bajo 'prestamo_lista', como en creditos/urls.py.
+    """
+    return f"{reverse('prestamo_lista')}{pk}/"
+
 def home(request):
     """Vista principal del sistema"""
     return render(request, 'creditos/home.html')
@@ -12,16 +50,24 @@ def prestamo_lista(request):
     """Lista todos los préstamos con búsqueda"""
     query = request.GET.get('q', '')
     
+    prestamos = Prestamo.objects.only(*PRESTAMO_LISTA_CAMPOS).annotate(
+        saldo_pendiente=Sum('amortizaciones__cuota', filter=Q(amortizaciones__pagado=False), default=0),
+    )
     if query:
-        prestamos = Prestamo.objects.filter(
+        prestamos = prestamos.filter(
             Q(nombre__icontains=query) | 
             Q(ci__icontains=query)
         )
-    else:
-        prestamos = Prestamo.objects.all()
+    
+    # Orden por clave primaria (indexada) para que LIMIT/OFFSET no requiera ordenar toda la tabla
+    prestamos = prestamos.order_by('-pk')
+    
+    # Renderizar solo la página actual
+    page_obj = Paginator(prestamos, PRESTAMOS_POR_PAGINA).get_page(request.GET.get('page'))
     
     context = {
-        'prestamos': prestamos,
+        'prestamos': page_obj,
+        'page_obj': page_obj,
         'query': query
     }
     return render(request, 'creditos/prestamo_lista.html', context)
@@ -34,12 +80,14 @@ def prestamo_crear(request):
             prestamo = form.save()
             messages.success(
                 request, 
-                f'Préstamo creado exitosamente para {prestamo.nombre}. '
-                f'Se generaron {prestamo.plazo} cuotas de amortización.'
+                format_lazy(
+                    _('Préstamo creado exitosamente para {}. Se generaron {} cuotas de amortización.'),
+                    prestamo.nombre, prestamo.plazo
+                )
             )
-            return redirect('prestamo_detalle', pk=prestamo.pk)
+            return HttpResponseRedirect(_detalle_url(prestamo.pk))
         else:
-            messages.error(request, 'Por favor corrija los errores en el formulario.')
+            messages.error(request, _('Por favor corrija los errores en el formulario.'))
     else:
         form = PrestamoForm()
     
@@ -51,22 +99,28 @@ def prestamo_crear(request):
 
 def prestamo_editar(request, pk):
     """Edita un préstamo existente"""
-    prestamo = get_object_or_404(Prestamo, pk=pk)
+    prestamo = get_object_or_404(Prestamo.objects.only(*PRESTAMO_EDITAR_CAMPOS), pk=pk)
     
     if request.method == 'POST':
         form = PrestamoForm(request.POST, instance=prestamo)
         if form.is_valid():
-            prestamo = form.save()
-            # Regenerar la tabla de amortización
-            prestamo.generar_amortizacion()
-            messages.success(
-                request, 
-                f'Préstamo actualizado exitosamente. '
-                f'Se regeneró la tabla de amortización con {prestamo.plazo} cuotas.'
-            )
-            return redirect('prestamo_detalle', pk=prestamo.pk)
+            cambios_financieros = set(Prestamo.CAMPOS_AMORTIZACION) & set(form.changed_data)
+            with transaction.atomic():
+                # save() regenera la tabla de amortización si cambiaron sus datos
+                prestamo = form.save()
+            if cambios_financieros:
+                messages.success(
+                    request, 
+                    format_lazy(
+                        _('Préstamo actualizado exitosamente. Se regeneró la tabla de amortización con {} cuotas.'),
+                        prestamo.plazo
+                    )
+                )
+            else:
+                messages.success(request, _('Préstamo actualizado exitosamente.'))
+            return HttpResponseRedirect(_detalle_url(prestamo.pk))
         else:
-            messages.error(request, 'Por favor corrija los errores en el formulario.')
+            messages.error(request, _('Por favor corrija los errores en el formulario.'))
     else:
         form = PrestamoForm(instance=prestamo)
     
@@ -79,37 +133,57 @@ def prestamo_editar(request, pk):
 
 def prestamo_detalle(request, pk):
     """Muestra el detalle del préstamo y su tabla de amortización"""
-    prestamo = get_object_or_404(Prestamo, pk=pk)
+    prestamo = get_object_or_404(Prestamo.objects.only(*PRESTAMO_DETALLE_CAMPOS), pk=pk)
     amortizaciones = prestamo.amortizaciones.all()
     
-    # Calcular totales
-    total_cuotas = sum(a.cuota for a in amortizaciones)
-    total_capital = sum(a.capital for a in amortizaciones)
-    total_interes = sum(a.interes for a in amortizaciones)
-    
-    # Calcular estado de pagos
-    cuotas_pagadas = amortizaciones.filter(pagado=True).count()
-    cuotas_pendientes = amortizaciones.filter(pagado=False).count()
+    # Solo pueden pagarse las cuotas hasta la primera pendiente (ver Amortizacion.puede_pagarse);
+    # las pendientes se cuentan de las cuotas guardadas, que pueden no ser exactamente `plazo`
+    pendientes = amortizaciones.filter(pagado=False).aggregate(
+        primera=Min('numero_cuota'),
+        cantidad=Count('pk'),
+    )
     
+    # Los totales se mantienen en el préstamo al escribir las cuotas
     context = {
         'prestamo': prestamo,
         'amortizaciones': amortizaciones,
-        'total_cuotas': total_cuotas,
-        'total_capital': total_capital,
-        'total_interes': total_interes,
-        'cuotas_pagadas': cuotas_pagadas,
-        'cuotas_pendientes': cuotas_pendientes,
+        'total_cuotas': prestamo.total_cuotas,
+        'total_capital': prestamo.total_capital,
+        'total_interes': prestamo.total_interes,
+        'cuotas_pagadas': prestamo.cuotas_pagadas,
+        'cuotas_pendientes': pendientes['cantidad'],
+        'primera_cuota_pendiente': pendientes['primera'],
     }
     return render(request, 'creditos/prestamo_detalle.html', context)
 
+def prestamo_detalle_json(request, pk):
+    """Devuelve la tabla de amortización y sus totales en JSON"""
+    prestamo = get_object_or_404(Prestamo.objects.only(*PRESTAMO_DETALLE_CAMPOS), pk=pk)
+    amortizaciones = list(prestamo.amortizaciones.values(
+        'numero_cuota', 'fecha_pago', 'cuota', 'capital', 'interes', 'saldo', 'pagado'
+    ))
+    
+    data = {
+        'amortizaciones': amortizaciones,
+        'total_cuotas': prestamo.total_cuotas,
+        'total_capital': prestamo.total_capital,
+        'total_interes': prestamo.total_interes,
+        'cuotas_pagadas': prestamo.cuotas_pagadas,
+        # Contadas de las filas ya leídas, que pueden no ser exactamente `plazo`
+        'cuotas_pendientes': sum(1 for fila in amortizaciones if not fila['pagado']),
+    }
+    return JsonResponse(data)
+
 def prestamo_eliminar(request, pk):
     """Elimina un préstamo"""
-    prestamo = get_object_or_404(Prestamo, pk=pk)
+    prestamo = get_object_or_404(Prestamo.objects.only(*PRESTAMO_ELIMINAR_CAMPOS), pk=pk)
     
     if request.method == 'POST':
         nombre = prestamo.nombre
+        # Las cuotas se borran en cascada con un único DELETE (fast delete) mientras
+        # Amortizacion no tenga señales pre/post_delete ni relaciones que dependan de ella
         prestamo.delete()
-        messages.success(request, f'Préstamo de {nombre} eliminado exitosamente.')
+        messages.success(request, format_lazy(_('Préstamo de {} eliminado exitosamente.'), nombre))
         return redirect('prestamo_lista')
     
     context = {
@@ -119,16 +193,16 @@ def prestamo_eliminar(request, pk):
 
 def amortizacion_actualizar(request, pk):
     """Actualiza el estado de una cuota de amortización"""
-    amortizacion = get_object_or_404(Amortizacion, pk=pk)
+    amortizacion = get_object_or_404(Amortizacion.objects.select_related('prestamo'), pk=pk)
     
     # Verificar si hay cuotas anteriores sin pagar
     cuota_anterior_pendiente = None
     if amortizacion.numero_cuota > 1:
         cuota_anterior_pendiente = Amortizacion.objects.filter(
-            prestamo=amortizacion.prestamo,
+            prestamo_id=amortizacion.prestamo_id,
             numero_cuota__lt=amortizacion.numero_cuota,
             pagado=False
-        ).first()
+        ).only('pk', 'numero_cuota').order_by('numero_cuota').first()
     
     if request.method == 'POST':
         form = AmortizacionForm(request.POST, instance=amortizacion)
@@ -136,11 +210,11 @@ def amortizacion_actualizar(request, pk):
             form.save()
             messages.success(
                 request, 
-                f'Cuota #{amortizacion.numero_cuota} actualizada exitosamente.'
+                format_lazy(_('Cuota #{} actualizada exitosamente.'), amortizacion.numero_cuota)
             )
-            return redirect('prestamo_detalle', pk=amortizacion.prestamo.pk)
+            return HttpResponseRedirect(_detalle_url(amortizacion.prestamo_id))
         else:
-            messages.error(request, 'Por favor corrija los errores en el formulario.')
+            messages.error(request, _('Por favor corrija los errores en el formulario.'))
     else:
         form = AmortizacionForm(instance=amortizacion)
     